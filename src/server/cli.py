@@ -3,14 +3,259 @@ MCP plugin for Google Keep integration.
 Provides tools for interacting with Google Keep notes through MCP.
 """
 
+import asyncio
+import itertools
 import json
+import logging
+import sys
+import time
+import traceback
+from contextlib import asynccontextmanager
+import gkeepapi.node as node_module
 from mcp.server.fastmcp import FastMCP
-from .keep_api import get_client, serialize_note, can_modify_note
+from .keep_api import get_client, get_keep_mcp_label, serialize_note, can_modify_note, _LIST_TYPE, debug_enabled
 
-mcp = FastMCP("keep")
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    
+    def _dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _dumps = json.dumps
+
+def _error_response(tool_name, error):
+    """
+    Log a failed tool call and build its error response.
+    The traceback is always logged, but only included in the response when KEEP_MCP_DEBUG is enabled.
+    
+    Args:
+        tool_name (str): The name of the tool that failed
+        error (Exception): The exception that was raised
+        
+    Returns:
+        str: JSON string containing the error message
+    """
+    logger.exception(f"Error in {tool_name}")
+    
+    error_msg = f"Error in {tool_name}: {error}"
+    if debug_enabled():
+        error_msg += f"\n{traceback.format_exc()}"
+    return _dumps({"error": error_msg})
+
+def _dumps_notes(notes):
+    """
+    Encode notes as a JSON array one note at a time.
+    Only the encoded chunks are kept around, not every note's dict as well.
+    
+    Args:
+        notes: An iterable of Google Keep notes or lists
+        
+    Returns:
+        str: JSON string containing the serialized notes
+    """
+    return '[' + ','.join(_dumps(serialize_note(note)) for note in notes) + ']'
+
+# gkeepapi's client is not thread-safe. Tools run concurrently on the event loop
+# and hand blocking calls to worker threads, so every tool holds this lock while
+# it touches the client.
+_keep_lock = asyncio.Lock()
+
+async def _run_in_thread(func, *args, **kwargs):
+    """
+    Run a blocking Keep client call in a worker thread. The caller must hold _keep_lock.
+    If the awaiting coroutine is cancelled, this still waits for the thread to
+    finish before re-raising, so the lock is never released while the client is in use.
+    
+    Args:
+        func: The blocking callable
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+        
+    Returns:
+        The return value of func
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The thread can't be interrupted, so wait it out even if cancelled again
+        while True:
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    continue
+            except Exception:
+                pass
+            break
+        raise
+
+# Set when local changes are waiting to be synced to the server
+_dirty = asyncio.Event()
+
+# How long to wait after a change so that a burst of edits shares one sync
+SYNC_DELAY = 0.15
+
+# How long to back off after a failed background sync before retrying
+SYNC_RETRY_DELAY = 5.0
+
+# How long a find result stays valid when nothing has changed in between
+FIND_CACHE_TTL = 2.0
+
+# Maps a find query to the time it was run and its encoded result
+_find_cache = {}
+
+# Starting sort keys for new lists. Keys only need to be unique within a list,
+# so cycling through the range gkeepapi draws its random seeds from is enough.
+_SORT_SEEDS = itertools.cycle(range(9_999_999_999, 999_999_999, -1_000_000))
+
+# The authenticated Keep client, once it has been created
+_keep = None
+
+async def _client():
+    """
+    Get the authenticated Keep client. The caller must hold _keep_lock, which
+    also ensures only one call ever authenticates.
+    
+    Returns:
+        gkeepapi.Keep: Authenticated Keep client
+    """
+    global _keep
+    
+    # Authenticating is a blocking round trip, but once it is done the client
+    # can be handed out without a trip through the thread pool
+    if _keep is None:
+        _keep = await _run_in_thread(get_client)
+    return _keep
+
+def _mark_dirty():
+    """
+    Record a local change: schedule a background sync and drop cached find results.
+    """
+    _find_cache.clear()
+    _dirty.set()
+
+async def _sync(keep):
+    """
+    Sync pending changes with the server. The caller must hold _keep_lock.
+    
+    Args:
+        keep: An authenticated Keep client
+    """
+    try:
+        await _run_in_thread(keep.sync)
+    finally:
+        # The sync may have pulled in changes made elsewhere
+        _find_cache.clear()
+    
+    # Only clear once the sync has gone through. If it failed or was cancelled,
+    # gkeepapi keeps the unsynced nodes dirty and the next sync retries them.
+    _dirty.clear()
+
+async def _sync_worker():
+    """
+    Background task that syncs local changes shortly after tools make them.
+    """
+    while True:
+        await _dirty.wait()
+        await asyncio.sleep(SYNC_DELAY)
+        
+        async with _keep_lock:
+            # A read or flush_sync may have synced in the meantime
+            if not _dirty.is_set():
+                continue
+            try:
+                keep = await _client()
+                await _sync(keep)
+                failed = False
+            except Exception:
+                logger.exception("Error in background sync")
+                failed = True
+        
+        if failed:
+            await asyncio.sleep(SYNC_RETRY_DELAY)
+
+@asynccontextmanager
+async def _lifespan(server):
+    """
+    Run the background syncer for the lifetime of the server and flush any
+    pending changes on shutdown.
+    """
+    worker = asyncio.create_task(_sync_worker())
+    try:
+        yield
+    finally:
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+        
+        async with _keep_lock:
+            if _dirty.is_set():
+                await _sync(await _client())
+
+mcp = FastMCP("keep", lifespan=_lifespan)
+
+async def _get_modifiable(note_id: str, *, require_list: bool = False):
+    """
+    Fetch a note or list that the server is allowed to modify.
+    
+    Args:
+        note_id (str): The ID of the note or list
+        require_list (bool, optional): Whether the node must be a list
+        
+    Returns:
+        gkeepapi.node.TopLevelNode: The note or list
+        
+    Raises:
+        ValueError: If the node doesn't exist, is not a list when one is required, or cannot be modified
+    """
+    kind = "List" if require_list else "Note"
+    
+    keep = await _client()
+    note = keep.get(note_id)
+    
+    if not note:
+        raise ValueError(f"{kind} with ID {note_id} not found")
+    
+    if require_list and type(note) is not _LIST_TYPE and not isinstance(note, _LIST_TYPE):
+        raise ValueError(f"Node with ID {note_id} is not a list")
+    
+    if not can_modify_note(note):
+        raise ValueError(f"{kind} with ID {note_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
+    
+    return note
+
+async def _get_list_item(list_id: str, item_id: str):
+    """
+    Fetch an item from a list that the server is allowed to modify.
+    
+    Items are looked up through the list's child index (a dict keyed by node ID)
+    instead of scanning ``note.items``, which re-sorts every item on each access.
+    
+    Args:
+        list_id (str): The ID of the list containing the item
+        item_id (str): The ID of the item
+        
+    Returns:
+        tuple: The list node and the list item
+        
+    Raises:
+        ValueError: If the list doesn't exist, is not a list, cannot be modified, or item not found
+    """
+    note = await _get_modifiable(list_id, require_list=True)
+    
+    item = note.get(item_id)
+    if not isinstance(item, node_module.ListItem) or item.deleted:
+        raise ValueError(f"Item with ID {item_id} not found in list {list_id}")
+    
+    return note, item
 
 @mcp.tool()
-def find(query="") -> str:
+async def find(query="") -> str:
     """
     Find notes based on a search query.
     
@@ -20,19 +265,39 @@ def find(query="") -> str:
     Returns:
         str: JSON string containing the matching notes with their id, title, text, pinned status, color and labels
     """
-    try:
-        keep = get_client()
-        notes = keep.find(query=query, archived=False, trashed=False)
-        
-        notes_data = [serialize_note(note) for note in notes]
-        return json.dumps(notes_data)
-    except Exception as e:
-        import traceback
-        error_msg = f"Error in find: {str(e)}\n{traceback.format_exc()}"
-        return json.dumps({"error": error_msg})
+    hit = _find_cache.get(query)
+    if hit and time.monotonic() - hit[0] < FIND_CACHE_TTL:
+        return hit[1]
+    
+    async with _keep_lock:
+        try:
+            keep = await _client()
+            if _dirty.is_set():
+                try:
+                    await _sync(keep)
+                except Exception:
+                    # Searching is local, so fall back to the local state; the
+                    # background syncer keeps retrying the pending changes
+                    logger.exception("Error syncing before find")
+            
+            notes = await _run_in_thread(
+                lambda: list(keep.find(query=query, archived=False, trashed=False))
+            )
+            
+            result = _dumps_notes(notes)
+            
+            now = time.monotonic()
+            for key, (cached_at, _) in list(_find_cache.items()):
+                if now - cached_at >= FIND_CACHE_TTL:
+                    del _find_cache[key]
+            _find_cache[query] = (now, result)
+            
+            return result
+        except Exception as e:
+            return _error_response("find", e)
 
 @mcp.tool()
-def create_note(title: str = None, text: str = None) -> str:
+async def create_note(title: str = None, text: str = None) -> str:
     """
     Create a new note with title and text.
     
@@ -43,27 +308,22 @@ def create_note(title: str = None, text: str = None) -> str:
     Returns:
         str: JSON string containing the created note's data
     """
-    try:
-        keep = get_client()
-        note = keep.createNote(title=title, text=text)
-        
-        # Get or create the keep-mcp label
-        label = keep.findLabel('keep-mcp')
-        if not label:
-            label = keep.createLabel('keep-mcp')
-        
-        # Add the label to the note
-        note.labels.add(label)
-        keep.sync()  # Ensure the note is created and labeled on the server
-        
-        return json.dumps(serialize_note(note))
-    except Exception as e:
-        import traceback
-        error_msg = f"Error in create_note: {str(e)}\n{traceback.format_exc()}"
-        return json.dumps({"error": error_msg})
+    async with _keep_lock:
+        try:
+            keep = await _client()
+            note = keep.createNote(title=title, text=text)
+            
+            # Add the keep-mcp label to the note
+            label = get_keep_mcp_label(keep)
+            note.labels.add(label)
+            _mark_dirty()
+            
+            return _dumps(serialize_note(note))
+        except Exception as e:
+            return _error_response("create_note", e)
 
 @mcp.tool()
-def update_note(note_id: str, title: str = None, text: str = None) -> str:
+async def update_note(note_id: str, title: str = None, text: str = None) -> str:
     """
     Update a note's properties.
     
@@ -78,25 +338,19 @@ def update_note(note_id: str, title: str = None, text: str = None) -> str:
     Raises:
         ValueError: If the note doesn't exist or cannot be modified
     """
-    keep = get_client()
-    note = keep.get(note_id)
-    
-    if not note:
-        raise ValueError(f"Note with ID {note_id} not found")
-    
-    if not can_modify_note(note):
-        raise ValueError(f"Note with ID {note_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
-    
-    if title is not None:
-        note.title = title
-    if text is not None:
-        note.text = text
-    
-    keep.sync()  # Ensure changes are saved to the server
-    return json.dumps(serialize_note(note))
+    async with _keep_lock:
+        note = await _get_modifiable(note_id)
+        
+        if title is not None:
+            note.title = title
+        if text is not None:
+            note.text = text
+        
+        _mark_dirty()
+        return _dumps(serialize_note(note))
 
 @mcp.tool()
-def delete_note(note_id: str) -> str:
+async def delete_note(note_id: str) -> str:
     """
     Delete a note (mark for deletion).
     
@@ -109,21 +363,15 @@ def delete_note(note_id: str) -> str:
     Raises:
         ValueError: If the note doesn't exist or cannot be modified
     """
-    keep = get_client()
-    note = keep.get(note_id)
-    
-    if not note:
-        raise ValueError(f"Note with ID {note_id} not found")
-    
-    if not can_modify_note(note):
-        raise ValueError(f"Note with ID {note_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
-    
-    note.delete()
-    keep.sync()  # Ensure deletion is saved to the server
-    return json.dumps({"message": f"Note {note_id} marked for deletion"})
+    async with _keep_lock:
+        note = await _get_modifiable(note_id)
+        
+        note.delete()
+        _mark_dirty()
+        return _dumps({"message": f"Note {note_id} marked for deletion"})
 
 @mcp.tool()
-def create_list(title: str = None, items: list = None) -> str:
+async def create_list(title: str = None, items: list = None) -> str:
     """
     Create a new list with title and items.
     
@@ -134,53 +382,55 @@ def create_list(title: str = None, items: list = None) -> str:
     Returns:
         str: JSON string containing the created list's data
     """
-    try:
-        keep = get_client()
-        
-        # Create an empty list first
-        note = keep.createList(title=title, items=[])
-        
-        # Get or create the keep-mcp label
-        label = keep.findLabel('keep-mcp')
-        if not label:
-            label = keep.createLabel('keep-mcp')
-        
-        # Add the label to the list
-        note.labels.add(label)
-        
-        # If items provided, add them with hierarchy support
-        if items:
-            # First pass: create all items at top level and build a mapping
-            item_mapping = {}  # Maps original item index to created ListItem
+    async with _keep_lock:
+        try:
+            keep = await _client()
             
-            import random
-            sort = random.randint(1000000000, 9999999999)
+            # Create an empty list first
+            note = keep.createList(title=title, items=[])
             
-            for i, item in enumerate(items):
-                if isinstance(item, dict):
-                    text = item.get('text', '')
-                    checked = item.get('checked', False)
-                else:
-                    # If item is just a string
-                    text = str(item)
-                    checked = False
-                
-                # Create the item
-                list_item = note.add(text, checked, sort)
-                sort -= note.SORT_DELTA
-                item_mapping[i] = list_item
+            # Add the keep-mcp label to the list
+            label = get_keep_mcp_label(keep)
+            note.labels.add(label)
             
-            # Second pass: set up hierarchy based on super_list_item_id
-            # Build a mapping from original IDs to item indices first
-            id_to_index = {}
-            for i, item in enumerate(items):
-                if isinstance(item, dict) and item.get('id'):
-                    id_to_index[item['id']] = i
-            
-            for i, item in enumerate(items):
-                if isinstance(item, dict) and item.get('super_list_item_id'):
-                    super_id = item.get('super_list_item_id')
+            # If items provided, add them with hierarchy support
+            if items:
+                # Create all items at top level, remembering which ones need to be indented
+                item_mapping = {}  # Maps original item index to created ListItem
+                id_to_index = {}  # Maps original item IDs to item indices
+                pending_indent = []  # (child index, super_list_item_id) pairs
+                
+                # Normalize items to (text, checked, id, super_list_item_id) tuples
+                parsed = []
+                for item in items:
+                    if isinstance(item, dict):
+                        parsed.append((
+                            item.get('text', ''),
+                            bool(item.get('checked', False)),
+                            item.get('id'),
+                            item.get('super_list_item_id'),
+                        ))
+                    else:
+                        # If item is just a string
+                        parsed.append((str(item), False, None, None))
+                
+                # Items keep their given order by getting descending sort keys
+                sort = next(_SORT_SEEDS)
+                delta = note.SORT_DELTA
+                sorts = range(sort, sort - len(parsed) * delta, -delta)
+                
+                for i, ((text, checked, item_id, super_id), item_sort) in enumerate(zip(parsed, sorts)):
+                    # Create the item
+                    list_item = note.add(text, checked, item_sort)
+                    item_mapping[i] = list_item
                     
+                    if item_id:
+                        id_to_index[item_id] = i
+                    if super_id:
+                        pending_indent.append((i, super_id))
+                
+                # Set up hierarchy once every item exists, since a child may come before its parent
+                for i, super_id in pending_indent:
                     # Find the parent item by its original ID
                     parent_index = id_to_index.get(super_id)
                     if parent_index is not None:
@@ -190,17 +440,15 @@ def create_list(title: str = None, items: list = None) -> str:
                         # If we found both parent and child, indent the child under parent
                         if parent_item and child_item:
                             parent_item.indent(child_item)
-        
-        keep.sync()  # Ensure the list is created and labeled on the server
-        
-        return json.dumps(serialize_note(note))
-    except Exception as e:
-        import traceback
-        error_msg = f"Error in create_list: {str(e)}\n{traceback.format_exc()}"
-        return json.dumps({"error": error_msg})
+            
+            _mark_dirty()
+            
+            return _dumps(serialize_note(note))
+        except Exception as e:
+            return _error_response("create_list", e)
 
 @mcp.tool()
-def add_list_item(list_id: str, text: str, checked: bool = False) -> str:
+async def add_list_item(list_id: str, text: str, checked: bool = False) -> str:
     """
     Add an item to an existing list.
     
@@ -215,26 +463,15 @@ def add_list_item(list_id: str, text: str, checked: bool = False) -> str:
     Raises:
         ValueError: If the list doesn't exist, is not a list, or cannot be modified
     """
-    import gkeepapi.node as node_module
-    
-    keep = get_client()
-    note = keep.get(list_id)
-    
-    if not note:
-        raise ValueError(f"List with ID {list_id} not found")
-    
-    if not isinstance(note, node_module.List):
-        raise ValueError(f"Node with ID {list_id} is not a list")
-    
-    if not can_modify_note(note):
-        raise ValueError(f"List with ID {list_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
-    
-    note.add(text, checked)
-    keep.sync()  # Ensure changes are saved to the server
-    return json.dumps(serialize_note(note))
+    async with _keep_lock:
+        note = await _get_modifiable(list_id, require_list=True)
+        
+        note.add(text, checked)
+        _mark_dirty()
+        return _dumps(serialize_note(note))
 
 @mcp.tool()
-def update_list_item(list_id: str, item_id: str, text: str = None, checked: bool = None) -> str:
+async def update_list_item(list_id: str, item_id: str, text: str = None, checked: bool = None) -> str:
     """
     Update an item in a list.
     
@@ -250,40 +487,19 @@ def update_list_item(list_id: str, item_id: str, text: str = None, checked: bool
     Raises:
         ValueError: If the list doesn't exist, is not a list, cannot be modified, or item not found
     """
-    import gkeepapi.node as node_module
-    
-    keep = get_client()
-    note = keep.get(list_id)
-    
-    if not note:
-        raise ValueError(f"List with ID {list_id} not found")
-    
-    if not isinstance(note, node_module.List):
-        raise ValueError(f"Node with ID {list_id} is not a list")
-    
-    if not can_modify_note(note):
-        raise ValueError(f"List with ID {list_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
-    
-    # Find the item
-    item = None
-    for list_item in note.items:
-        if list_item.id == item_id:
-            item = list_item
-            break
-    
-    if not item:
-        raise ValueError(f"Item with ID {item_id} not found in list {list_id}")
-    
-    if text is not None:
-        item.text = text
-    if checked is not None:
-        item.checked = checked
-    
-    keep.sync()  # Ensure changes are saved to the server
-    return json.dumps(serialize_note(note))
+    async with _keep_lock:
+        note, item = await _get_list_item(list_id, item_id)
+        
+        if text is not None:
+            item.text = text
+        if checked is not None:
+            item.checked = checked
+        
+        _mark_dirty()
+        return _dumps(serialize_note(note))
 
 @mcp.tool()
-def delete_list_item(list_id: str, item_id: str) -> str:
+async def delete_list_item(list_id: str, item_id: str) -> str:
     """
     Delete an item from a list.
     
@@ -297,40 +513,34 @@ def delete_list_item(list_id: str, item_id: str) -> str:
     Raises:
         ValueError: If the list doesn't exist, is not a list, cannot be modified, or item not found
     """
-    import gkeepapi.node as node_module
-    
-    keep = get_client()
-    note = keep.get(list_id)
-    
-    if not note:
-        raise ValueError(f"List with ID {list_id} not found")
-    
-    if not isinstance(note, node_module.List):
-        raise ValueError(f"Node with ID {list_id} is not a list")
-    
-    if not can_modify_note(note):
-        raise ValueError(f"List with ID {list_id} cannot be modified (missing keep-mcp label and UNSAFE_MODE is not enabled)")
-    
-    # Find the item
-    item = None
-    for list_item in note.items:
-        if list_item.id == item_id:
-            item = list_item
-            break
-    
-    if not item:
-        raise ValueError(f"Item with ID {item_id} not found in list {list_id}")
+    async with _keep_lock:
+        note, item = await _get_list_item(list_id, item_id)
+        
+        item.delete()
+        _mark_dirty()
+        return _dumps(serialize_note(note))
+
+@mcp.tool()
+async def flush_sync() -> str:
+    """
+    Sync pending changes to Google Keep immediately.
+    Changes made by the other tools are synced in the background shortly after they are made.
     
-    item.delete()
-    keep.sync()  # Ensure changes are saved to the server
-    return json.dumps(serialize_note(note))
+    Returns:
+        str: Success message
+    """
+    async with _keep_lock:
+        try:
+            keep = await _client()
+            await _sync(keep)
+            return _dumps({"message": "All changes synced"})
+        except Exception as e:
+            return _error_response("flush_sync", e)
 
 def main():
     try:
         mcp.run(transport='stdio')
     except Exception as e:
-        import traceback
-        import sys
         print(f"Error in MCP server: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
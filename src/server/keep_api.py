@@ -1,8 +1,16 @@
 import gkeepapi
+import gkeepapi.node as node_module
 import os
+import threading
 from dotenv import load_dotenv
 
+# gkeepapi hands back plain List nodes, so an identity check on the type almost
+# always settles it without going through isinstance
+_LIST_TYPE = node_module.List
+
 _keep_client = None
+_keep_mcp_label = None
+_keep_mcp_label_lock = threading.Lock()
 
 def get_client():
     """
@@ -38,6 +46,38 @@ def get_client():
     
     return keep
 
+def get_keep_mcp_label(keep):
+    """
+    Get or create the keep-mcp label.
+    The label is resolved once and reused, so note creation does not have to
+    scan every label on each call.
+    
+    Args:
+        keep: An authenticated Keep client
+        
+    Returns:
+        gkeepapi.node.Label: The keep-mcp label
+    """
+    global _keep_mcp_label
+    
+    with _keep_mcp_label_lock:
+        label = _keep_mcp_label
+        
+        # A sync may replace, delete or rename labels, so only trust the cached
+        # object while the client still holds it under the same name
+        if (
+            label is None
+            or label.deleted
+            or label.name != 'keep-mcp'
+            or keep.getLabel(label.id) is not label
+        ):
+            label = keep.findLabel('keep-mcp')
+            if not label:
+                label = keep.createLabel('keep-mcp')
+            _keep_mcp_label = label
+        
+        return label
+
 def serialize_note(note):
     """
     Serialize a Google Keep note or list into a dictionary.
@@ -48,8 +88,6 @@ def serialize_note(note):
     Returns:
         dict: A dictionary containing the note's id, title, text/items, pinned status, color and labels
     """
-    import gkeepapi.node as node_module
-    
     base_data = {
         'id': note.id,
         'title': note.title,
@@ -60,7 +98,7 @@ def serialize_note(note):
     }
     
     # Check if this is a List node
-    if isinstance(note, node_module.List):
+    if type(note) is _LIST_TYPE or isinstance(note, _LIST_TYPE):
         base_data['items'] = [
             {
                 'text': item.text,
@@ -89,6 +127,15 @@ def can_modify_note(note):
     unsafe_mode = os.getenv('UNSAFE_MODE', '').lower() == 'true'
     return unsafe_mode or has_keep_mcp_label(note)
 
+def debug_enabled():
+    """
+    Check if tracebacks should be included in tool error responses.
+    
+    Returns:
+        bool: True if KEEP_MCP_DEBUG is enabled, False otherwise
+    """
+    return os.getenv('KEEP_MCP_DEBUG', '').lower() in ('1', 'true')
+
 def has_keep_mcp_label(note):
     """
     Check if a note has the keep-mcp label.